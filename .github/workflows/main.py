@@ -1,9 +1,11 @@
 import re
 import ast
 import math
-import operator as op
 import sqlite3
 import os
+import functools
+import threading
+import queue
 
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
@@ -16,62 +18,101 @@ from kivy.graphics import Color, RoundedRectangle
 from kivy.utils import get_color_from_hex
 from kivy.properties import StringProperty, BooleanProperty, NumericProperty
 from kivy.animation import Animation
+from kivy.clock import Clock
 from kivy.metrics import dp
 from kivy.core.window import Window
 
 # ---------- UPGRADED MATH PARSER (3.13 COMPLIANT) ----------
 class MathParser:
+    # UPGRADE: Shared class-level tables/regex -- built once, never per instance
+    constants = {'pi': math.pi, 'e': math.e}
+    functions = {
+        'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+        'asin': math.asin, 'acos': math.acos, 'atan': math.atan,
+        'log': math.log10, 'ln': math.log, 'sqrt': math.sqrt, 'radians': math.radians
+    }
+    _trig_re = re.compile(r'(?<![a-zA-Z_])(?P<fn>sin|cos|tan)\s*\(')
+    _IMPL_MUL_LEFT = re.compile(r'(\d)(pi|e|\()')
+    _IMPL_MUL_RIGHT = re.compile(r'(\))(\d|\()')
+    # One-pass symbol rewrite instead of three chained str.replace calls
+    _TRANS_TABLE = str.maketrans({'π': 'pi', '^': '**', '√': 'sqrt'})
+    # Whitelist of allowed AST nodes; anything else is rejected before eval
+    _ALLOWED_NODES = {
+        ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name,
+        ast.Call, ast.Load, ast.Add, ast.Sub, ast.Mult, ast.Div,
+        ast.Pow, ast.Mod, ast.USub, ast.UAdd
+    }
+    # Single lookup namespace handed to eval(); no builtins ever leak in
+    _ENV = {**constants, **functions}
+
+    # UPGRADE: Per-node checks dispatch on exact type -- one dict lookup per
+    # node instead of isinstance MRO walks across the whole tree
+    def _check_name(node):
+        if node.id not in MathParser._ENV:
+            raise NameError(node.id)
+
+    def _check_call(node):
+        if type(node.func) is not ast.Name or node.func.id not in MathParser.functions:
+            raise NameError('call')
+
+    _VALIDATORS = {ast.Name: _check_name, ast.Call: _check_call}
+
     def __init__(self, use_degrees=True):
         self.use_degrees = use_degrees
-        # Whitelist of allowed operations
-        self.operators = {
-            ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul,
-            ast.Div: op.truediv, ast.Pow: op.pow, ast.Mod: op.mod, 
-            ast.USub: op.neg, ast.UAdd: lambda x: x
-        }
-        self.constants = {'pi': math.pi, 'e': math.e}
-        self.functions = {
-            'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
-            'asin': math.asin, 'acos': math.acos, 'atan': math.atan,
-            'log': math.log10, 'ln': math.log, 'sqrt': math.sqrt, 'radians': math.radians
-        }
-        self._trig_re = re.compile(r'(?<![a-zA-Z_])(?P<fn>sin|cos|tan)\s*\(')
-
-    def evaluate(self, expression: str):
+
+    def evaluate(self, expression: str, paren_depth=None):
+        return self._evaluate_cached(self._normalize(expression, paren_depth))
+
+    def _normalize(self, expression: str, paren_depth=None) -> str:
         expression = (expression or '').strip()
         if not expression: raise ValueError("Empty")
 
         # UPGRADE: Handling implicit multiplication (e.g., 5pi, 2(3))
-        expression = expression.replace('π', 'pi').replace('^', '**').replace('√', 'sqrt')
-        expression = re.sub(r'(\d)(pi|e|\()', r'\1*\2', expression)
-        expression = re.sub(r'(\))(\d|\()', r'\1*\2', expression)
+        expression = expression.translate(self._TRANS_TABLE)
+        expression = self._IMPL_MUL_LEFT.sub(r'\1*\2', expression)
+        expression = self._IMPL_MUL_RIGHT.sub(r'\1*\2', expression)
 
         if self.use_degrees:
-            expression = self._trig_re.sub(r"\g<fn>(radians(", expression)
+            expression, n_trig = self._trig_re.subn(r"\g<fn>(radians(", expression)
+        else:
+            n_trig = 0
 
-        # UPGRADE: Auto-balancing parentheses
-        diff = expression.count('(') - expression.count(')')
+        # UPGRADE: Auto-balancing parentheses. Callers that track depth
+        # incrementally (on_key does) skip the two full str.count scans;
+        # each deg-mode trig rewrite opened one extra 'radians(' paren.
+        if paren_depth is None:
+            diff = expression.count('(') - expression.count(')')
+        else:
+            diff = paren_depth + n_trig
         if diff > 0: expression += ')' * diff
 
-        node = ast.parse(expression, mode='eval').body
-        return self._eval(node)
+        return expression
 
-    def _eval(self, node):
-        # UPGRADE: ast.Constant is the standard for Python 3.8 to 3.13+
-        if isinstance(node, ast.Constant): return node.value
-        if isinstance(node, ast.Num): return node.n # Legacy fallback
-        if isinstance(node, ast.Name):
-            if node.id in self.constants: return self.constants[node.id]
-            raise NameError(node.id)
-        if isinstance(node, ast.BinOp):
-            return self.operators[type(node.op)](self._eval(node.left), self._eval(node.right))
-        if isinstance(node, ast.UnaryOp):
-            return self.operators[type(node.op)](self._eval(node.operand))
-        if isinstance(node, ast.Call):
-            fname = node.func.id
-            if fname not in self.functions: raise NameError(fname)
-            return self.functions[fname](*[self._eval(a) for a in node.args])
-        raise TypeError("Unsupported")
+    # UPGRADE: Parsing dominates the cost of an evaluation, so memoize the
+    # normalized expression -> code object (and the final result) across key
+    # presses. The expression is validated once against the node whitelist,
+    # then evaluated as CPython bytecode instead of a Python-level AST walk.
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def _compile(cls, normalized: str):
+        tree = ast.parse(normalized, mode='eval')
+        for node in ast.walk(tree):
+            node_type = type(node)
+            if node_type not in cls._ALLOWED_NODES:
+                raise ValueError(node_type.__name__)
+            check = cls._VALIDATORS.get(node_type)
+            if check is not None:
+                check(node)
+        return compile(tree, '<calc>', 'eval')
+
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def _evaluate_cached(cls, normalized: str):
+        return eval(cls._compile(normalized), {'__builtins__': {}}, cls._ENV)
+
+# UPGRADE: Shared singletons (one per angle mode) so the lru_caches survive
+# across key presses instead of dying with a throwaway parser instance.
+_PARSERS = {True: MathParser(use_degrees=True), False: MathParser(use_degrees=False)}
 
 # ---------- UI STYLING ----------
 COLORS = {
@@ -79,8 +120,18 @@ COLORS = {
     'num': '#263238', 'op': '#1c252b', 'err': '#ff5252', 'text': '#ffffff'
 }
 
+# UPGRADE: Declarative key -> color LUT; build() does one dict lookup per key
+# instead of four list scans
+KEY_COLOR = {k: COLORS['accent'] for k in ('/', '*', '-', '+', '=', '^', '%')} \
+          | {k: COLORS['err'] for k in ('AC', 'DEL')} \
+          | {'MS': '#546e7a', 'MR': '#546e7a'}
+
 class StyledButton(Button):
+    # UPGRADE: Shared across all 30 buttons instead of one list per instance
+    _RADIUS = [dp(12)]
+
     def __init__(self, bg_color=COLORS['num'], **kwargs):
+        kwargs.setdefault('font_size', '18sp')
         super().__init__(**kwargs)
         self.background_normal = ''
         self.background_down = ''
@@ -88,17 +139,26 @@ class StyledButton(Button):
         self.btn_color = get_color_from_hex(bg_color)
         with self.canvas.before:
             self.color_obj = Color(rgba=self.btn_color)
-            self.rect = RoundedRectangle(size=self.size, pos=self.pos, radius=[dp(12)])
+            self.rect = RoundedRectangle(size=self.size, pos=self.pos, radius=self._RADIUS)
         self.bind(pos=self._update_rect, size=self._update_rect)
 
-    def _update_rect(self, instance, value):
-        self.rect.pos, self.rect.size = instance.pos, instance.size
+    @staticmethod
+    def _update_rect(instance, value):
+        instance.rect.pos, instance.rect.size = instance.pos, instance.size
+
+    # UPGRADE: Haptic-style feedback on touch -- routed through a property
+    # so redundant writes never dirty the canvas instruction
+    pressed = BooleanProperty(False)
 
-    # UPGRADE: Haptic-style feedback on touch
     def on_press(self):
-        self.color_obj.a = 0.5
+        self.pressed = True
     def on_release(self):
-        self.color_obj.a = 1.0
+        self.pressed = False
+
+    def on_pressed(self, instance, value):
+        new = 0.5 if value else 1.0
+        if self.color_obj.a != new:
+            self.color_obj.a = new
 
 # ---------- MAIN APP ----------
 class LegendaryCalc(App):
@@ -106,13 +166,32 @@ class LegendaryCalc(App):
     is_deg = BooleanProperty(True)
     mem = NumericProperty(0)
 
+    # Single SQL literal so sqlite3's statement cache always hits
+    _INSERT_SQL = 'INSERT INTO log VALUES (?)'
+
     def build(self):
         # UPGRADE: Safer Android DB pathing
         os.makedirs(self.user_data_dir, exist_ok=True)
         self.db_path = os.path.join(self.user_data_dir, 'history.db')
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # UPGRADE: WAL + relaxed sync; the per-commit fsync on Android flash
+        # is what makes '=' feel sluggish, not the insert itself
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-2000')
         self.conn.execute('CREATE TABLE IF NOT EXISTS log (entry TEXT)')
-        
+        # UPGRADE: History writes happen on a worker thread so fsync latency
+        # never blocks the Kivy main loop (check_same_thread=False above)
+        self._hist_q = queue.Queue()
+        self._hist_thread = threading.Thread(target=self._hist_worker, daemon=True)
+        self._hist_thread.start()
+
+        # UPGRADE: Pick a prebuilt parser per angle mode instead of
+        # constructing one on every '=' press
+        self._parsers = _PARSERS
+
+
         root = BoxLayout(orientation='vertical', padding=dp(15), spacing=dp(8))
 
         # Display Area
@@ -121,6 +200,10 @@ class LegendaryCalc(App):
             self.bg_color = Color(rgba=get_color_from_hex(COLORS['display']))
             self.bg_rect = RoundedRectangle(radius=[dp(20)])
         display_box.bind(pos=self._update_ui, size=self._update_ui)
+        # UPGRADE: One reusable error flash instead of two Animation
+        # allocations every time '=' is mashed on a bad expression
+        self._err_anim = Animation(rgba=get_color_from_hex(COLORS['err']), duration=0.1) + \
+                         Animation(rgba=get_color_from_hex(COLORS['display']), duration=0.2)
 
         # Status/Header
         status = BoxLayout(size_hint_y=0.2)
@@ -136,6 +219,11 @@ class LegendaryCalc(App):
         # UPGRADE: Reactive Label binding for instant updates
         self.lbl = Label(text=self.expression, halign='right', valign='center', font_size='48sp')
         self.lbl.bind(size=self._update_lbl)
+        # UPGRADE: The expression lives in a token list; the string is only
+        # joined when the display needs it, so entry stays O(n) overall
+        self._tokens = []
+        self._paren_depth = 0
+        self._pending_flush = False
         self.bind(expression=self._sync_expression)
         display_box.add_widget(self.lbl)
         
@@ -152,19 +240,25 @@ class LegendaryCalc(App):
             'π', '0', '.', 'e', '='
         ]
         for k in keys:
-            c = COLORS['num']
-            if k in ['/','*','-','+','=','^','%']: c = COLORS['accent']
-            elif k in ['AC','DEL']: c = COLORS['err']
-            elif k in ['MS', 'MR']: c = '#546e7a'
-            btn = StyledButton(text=k, bg_color=c, font_size='18sp')
+            btn = StyledButton(text=k, bg_color=KEY_COLOR.get(k, COLORS['num']))
             btn.bind(on_press=self.on_key) # Trigger on press for speed
             grid.add_widget(btn)
         
         root.add_widget(grid)
         return root
 
+    # UPGRADE: Coalesce bursts of key presses into one label update per frame
     def _sync_expression(self, inst, val):
-        self.lbl.text = val
+        if not self._pending_flush:
+            self._pending_flush = True
+            Clock.schedule_once(self._flush_expr, 0)
+
+    def _flush_expr(self, dt):
+        self._pending_flush = False
+        # Single descriptor read; StringProperty access isn't free on ARM
+        expr = self.expression
+        if self.lbl.text != expr:
+            self.lbl.text = expr
 
     def _update_ui(self, i, v):
         self.bg_rect.pos, self.bg_rect.size = i.pos, i.size
@@ -176,54 +270,119 @@ class LegendaryCalc(App):
         self.is_deg = not self.is_deg
         self.unit_btn.text = 'DEG' if self.is_deg else 'RAD'
 
+    def _refresh_expression(self):
+        self.expression = ''.join(self._tokens) or '0'
+
     def on_key(self, instance):
         val = instance.text
-        if val == 'AC': 
-            self.expression = '0'
-        elif val == 'DEL': 
-            self.expression = (self.expression[:-1] or '0')
-        elif val == 'MS': 
-            try: self.mem = float(self.expression)
+        tokens = self._tokens
+        if val == 'AC':
+            tokens.clear()
+            self._paren_depth = 0
+        elif val == 'DEL':
+            # One pop per press; multi-char tokens like 'sin(' go in one go
+            if tokens:
+                popped = tokens.pop()
+                self._paren_depth -= popped.count('(') - popped.count(')')
+        elif val == 'MS':
+            try: self.mem = float(''.join(tokens) or '0')
             except: pass
-        elif val == 'MR': 
-            self.expression = (str(self.mem) if self.expression == '0' else self.expression + str(self.mem))
-        elif val == '=': 
+        elif val == 'MR':
+            tokens.append(str(self.mem))
+        elif val == '=':
             self.run_math()
+            return
         else:
             # Special Handling for functions
             token = 'sqrt(' if val == '√' else (val + '(' if val in ['sin','cos','tan'] else val)
-            if self.expression == '0' and val not in ('.','%'):
-                self.expression = token
-            else:
-                self.expression += token
+            if not tokens and val in ('.','%'):
+                tokens.append('0')
+            elif tokens == ['0'] and val not in ('.','%'):
+                # A sole '0' (fresh start, typed 0, or a computed zero) is
+                # the display placeholder -- replace it, as the string-based
+                # display always did
+                tokens.clear()
+            tokens.append(token)
+            # UPGRADE: Track paren depth as tokens land so '=' balances in
+            # O(1) instead of rescanning the whole expression
+            self._paren_depth += token.count('(') - token.count(')')
+        self._refresh_expression()
 
     def run_math(self):
         try:
-            p = MathParser(use_degrees=self.is_deg)
-            res = p.evaluate(self.expression)
-            formatted = '{:.8g}'.format(res)
-            # Store to history
-            self.conn.execute('INSERT INTO log VALUES (?)', (f"{self.expression} = {formatted}",))
-            self.conn.commit()
-            self.expression = formatted
-        except:
+            p = self._parsers[self.is_deg]
+            expr = ''.join(self._tokens) or '0'
+            res = p.evaluate(expr, self._paren_depth)
+            # UPGRADE: Integer answers skip the float->decimal .8g path
+            formatted = str(int(res)) if isinstance(res, float) and res.is_integer() \
+                and abs(res) < 1e15 else f'{res:.8g}'
+            # Store to history (queued; the worker batches inserts)
+            self._hist_q.put((f"{expr} = {formatted}",))
+            self._tokens[:] = [formatted]
+        except (ValueError, SyntaxError, NameError, TypeError,
+                ZeroDivisionError, OverflowError, KeyError):
             # Error animation
-            anim = Animation(rgba=get_color_from_hex(COLORS['err']), duration=0.1) + \
-                   Animation(rgba=get_color_from_hex(COLORS['display']), duration=0.2)
-            anim.start(self.bg_color)
-            self.expression = 'Error'
+            self._err_anim.stop(self.bg_color)
+            self._err_anim.start(self.bg_color)
+            self._tokens[:] = ['Error']
+        self._paren_depth = 0
+        self._refresh_expression()
+
+    def _hist_worker(self):
+        q = self._hist_q
+        while True:
+            rows = [q.get()]
+            try:
+                while True:
+                    rows.append(q.get_nowait())
+            except queue.Empty:
+                pass
+            stop = rows[-1] is None  # shutdown sentinel from on_stop
+            if stop:
+                rows.pop()
+            try:
+                if rows:
+                    with self.conn:
+                        self.conn.executemany(self._INSERT_SQL, rows)
+            except sqlite3.Error:
+                # Drop the batch rather than die: an unmarked task would
+                # leave every later Queue.join() hanging the UI forever
+                pass
+            finally:
+                for _ in range(len(rows) + stop):
+                    q.task_done()
+            if stop:
+                return
+
+    def _flush_history(self):
+        # Block until the worker has drained everything queued so far
+        self._hist_q.join()
+
+    # UPGRADE: Android lifecycle -- land pending entries before backgrounding
+    def on_pause(self):
+        self._flush_history()
+        return True
+
+    def on_stop(self):
+        self._hist_q.put(None)
+        self._hist_thread.join()
+        # UPGRADE: Finalize the WAL and stats so it can't grow unboundedly
+        # across sessions and slow down the history view over time
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
 
     def show_log(self, _):
+        self._flush_history()
         v = ModalView(size_hint=(0.85, 0.75))
         scroll = ScrollView()
-        box = BoxLayout(orientation='vertical', size_hint_y=None, padding=dp(20), spacing=dp(10))
-        box.bind(minimum_height=box.setter('height'))
-        cursor = self.conn.execute('SELECT entry FROM log ORDER BY rowid DESC LIMIT 50')
-        for row in cursor:
-            lbl = Label(text=row[0], size_hint_y=None, height=dp(42), halign='left')
-            lbl.bind(size=lambda l, v: setattr(l, 'text_size', (l.width, None)))
-            box.add_widget(lbl)
-        scroll.add_widget(box)
+        rows = self.conn.execute('SELECT entry FROM log ORDER BY rowid DESC LIMIT 50').fetchall()
+        # UPGRADE: One multiline label for the whole view instead of 50
+        # widgets each carrying their own binding and layout pass
+        lbl = Label(text='\n'.join(r[0] for r in rows), halign='left', valign='top',
+                    size_hint_y=None, padding=(dp(20), dp(20)), line_height=1.4)
+        lbl.bind(width=lambda l, w: setattr(l, 'text_size', (w, None)),
+                 texture_size=lambda l, ts: setattr(l, 'height', ts[1]))
+        scroll.add_widget(lbl)
         v.add_widget(scroll)
         v.open()
 